@@ -5,6 +5,8 @@ MassFunctionCalculator for mass functions, obtains results, and
 then calls the new plotting function with user-defined 'keys' and colors.
 """
 
+import matplotlib.pyplot as plt
+
 from src.calculations import MassFunctionCalculator
 from src.plotting import plot_results
 
@@ -52,6 +54,7 @@ def main():
                  data_filename='sham_lognormal_distributions.dat',
                  user_colors=user_colors,
                  colormap='coolwarm')
+    plt.show()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
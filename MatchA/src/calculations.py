@@ -4,14 +4,72 @@ This module contains the MassFunctionCalculator class, which handles
 the main computations (SHAM, HMF, etc.).
 """
 
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
+
 import numpy as np
 from hmf import MassFunction
-from scipy import interpolate
-import scipy.optimize as opt
 # Relative imports for halo_assembly and gsmf
 from . import halo_assembly as hal
 from . import gsmf as smf
 
+# Default GSMF used for the abundance matching (see smf.gsmf_params). The
+# reference curves in sham_lognormal_distributions.dat are matched to the
+# observed GSMF: their z=0 number densities are its integrals
+_GSMF_MODE = "observed_smf"
+
+@lru_cache(maxsize=256)
+def _mf_cached(z, h, Om0, Ob0, n, s8):
+    """
+    Build a MassFunction object from the 'hmf' library on the full mass grid,
+    cached so that every (z, cosmology) combination is constructed only once.
+    The grid starts at log10 M = 7 so that it also covers the low-mass
+    progenitors at high redshift.
+
+    The returned object is shared between callers and must not be modified
+    (e.g. with MassFunction.update).
+
+    :param z: float, redshift (rounded by the caller so it can be cached)
+    :param h, Om0, Ob0, n, s8: float, cosmological parameters
+    :return: hmf.MassFunction instance
+    """
+    return MassFunction(
+        z=z,
+        cosmo_params={
+            "Om0": Om0,
+            "Ob0": Ob0,
+            "Tcmb0": 2.725,
+            "Neff": 3.05,
+            "H0": 100.0 * h
+        },
+        n=n,
+        sigma_8=s8,
+        Mmin=7,
+        Mmax=16,
+        dlog10m=0.01,
+        transfer_model="EH",
+        mdef_model="SOVirial",
+        hmf_model="Behroozi"
+    )
+
+def _check_interp_range(x, xp, name):
+    """
+    np.interp clamps values outside the table to its end points; raise
+    instead, like the interp1d lookups it replaced, so that out-of-range
+    inputs fail loudly rather than return plausible-looking numbers.
+
+    :param x: float or array, values to look up
+    :param xp: 1D increasing array, abscissae of the table
+    :param name: str, name of the looked-up quantity (for the message)
+    """
+    x = np.asarray(x)
+    if np.any(x < xp[0]) or np.any(x > xp[-1]):
+        raise ValueError(
+            f"A value of {name} is outside the interpolation range "
+            f"[{xp[0]:.6g}, {xp[-1]:.6g}]."
+        )
+
 class MassFunctionCalculator:
     """
     Encapsulates methods for computing halo masses via SHAM, 
@@ -52,70 +110,121 @@ class MassFunctionCalculator:
         :return: float, log10 of the halo mass that matches n_gal
         """
         # Create a MassFunction object from the 'hmf' library
-        mf = MassFunction(
-            z=z,
-            cosmo_params={
-                "Om0": self.O_m0,
-                "Ob0": self.O_b0,
-                "Tcmb0": 2.725,
-                "Neff": 3.05,
-                "H0": 100.0 * self.h_0
-            },
-            n=self.n,
-            sigma_8=self.sigma_8,
-            Mmin=9,
-            Mmax=16,
-            dlog10m=0.01,
-            transfer_model="EH",
-            mdef_model="SOVirial",
-            hmf_model="Behroozi"
-        )
+        mf = self._mass_function(z)
         
-        # Total cumulative halo function
-        nvir = hal.Total_cumulative_halo_function(np.log10(mf.m), mf.ngtm, z, self.h_0)
-        
-        # We interpolate log(nvir) -> log(mass)
-        hmf_int = interpolate.interp1d(np.log10(nvir), np.log10(mf.m))
-        
-        # Return log10 of the mass that matches the desired n_gal
-        return hmf_int(np.log10(n_gal))
+        # We interpolate log(nvir) -> log(mass). nvir decreases with mass,
+        # so both arrays are reversed to give np.interp increasing abscissae.
+        # Masses where nvir underflows to zero (already inside hmf's ngtm)
+        # are left out of the table.
+        with np.errstate(divide='ignore'):
+            # Total cumulative halo function
+            nvir = hal.Total_cumulative_halo_function(np.log10(mf.m), mf.ngtm, z, self.h_0)
+            log_nvir = np.log10(nvir)[::-1]
+        log_m = np.log10(mf.m)[::-1]
+        finite = np.isfinite(log_nvir)
+        log_nvir, log_m = log_nvir[finite], log_m[finite]
+        # Non-positive densities cannot be matched: they give NaN, like NaN
+        # inputs do (np.interp propagates them, and the range check skips them)
+        log_n_gal = np.log10(np.where(np.asarray(n_gal) > 0, n_gal, np.nan))
+        _check_interp_range(log_n_gal, log_nvir, 'log10(n_gal)')
+        return np.interp(log_n_gal, log_nvir, log_m)
     
-    def hmf(self, z, logMvir, epsilon=1e-5):
+    def _mass_function(self, z):
+        """
+        Return the shared, cached MassFunction for this cosmology at redshift z
+        (see _mf_cached), used by SHAM, hmf and compute_values.
+
+        :param z: float, redshift
+        :return: hmf.MassFunction instance (read-only)
+        """
+        return _mf_cached(round(float(z), 8), self.h_0, self.O_m0, self.O_b0,
+                          self.n, self.sigma_8)
+
+    def hmf(self, z, logMvir):
         """
         Compute the halo number density nvir for a given log10 halo mass 
         using the 'hmf' library at a specified redshift.
 
         :param z: float, redshift
-        :param logMvir: float, log10(Mvir)
-        :param epsilon: float, small interval for Mmin/Mmax in hmf
-        :return: float, nvir
-        """
-        mf = MassFunction(
-            z=z,
-            cosmo_params={
-                "Om0": self.O_m0,
-                "Ob0": self.O_b0,
-                "Tcmb0": 2.725,
-                "Neff": 3.05,
-                "H0": 100.0 * self.h_0
-            },
-            n=self.n,
-            sigma_8=self.sigma_8,
-            Mmin=logMvir - epsilon,
-            Mmax=logMvir + epsilon,
-            dlog10m=epsilon / 2.0,
-            transfer_model="EH",
-            mdef_model="SOVirial",
-            hmf_model="Behroozi"
-        )
+        :param logMvir: float or array, log10(Mvir)
+        :return: float or array, nvir
+        """
+        mf = self._mass_function(z)
         
-        nvir = hal.Total_cumulative_halo_function(np.log10(mf.m), mf.ngtm, z, self.h_0)
-        hmf_int = interpolate.interp1d(np.log10(mf.m), np.log10(nvir))
+        # nvir underflows to zero at the high-mass end, where its log10 is -inf
+        with np.errstate(divide='ignore'):
+            nvir = hal.Total_cumulative_halo_function(np.log10(mf.m), mf.ngtm, z, self.h_0)
+            log_nvir = np.log10(nvir)
         
         # Return 10^(interpolated value)
-        return 10 ** hmf_int(logMvir)
+        log_m = np.log10(mf.m)
+        _check_interp_range(logMvir, log_m, 'logMvir')
+        return 10 ** np.interp(logMvir, log_m, log_nvir)
+    
+    def hmf_vec(self, z, logMvir, table=None):
+        """
+        Vectorized counterpart of hmf: computes nvir for each pair
+        (z[i], logMvir[i]) with a single gather on the per-redshift tables.
+
+        :param z: array, redshifts
+        :param logMvir: array, log10(Mvir) (same length as z)
+        :param table: optional tuple (log_m, log_nvir) from _log_nvir_table(z),
+                      reused instead of being rebuilt
+        :return: array, nvir
+        """
+        z = np.asarray(z, dtype=float)
+        logMvir = np.asarray(logMvir, dtype=float)
+        log_m, log_nvir = self._log_nvir_table(z) if table is None else table
+
+        # Linear interpolation in row i of the table
+        _check_interp_range(logMvir, log_m, 'logMvir')
+        j = np.clip(np.searchsorted(log_m, logMvir) - 1, 0, log_m.size - 2)
+        t = (logMvir - log_m[j]) / (log_m[j + 1] - log_m[j])
+        rows = np.arange(z.size)
+
+        log_nvir_out = np.empty_like(z)
+        np.multiply(t, log_nvir[rows, j + 1] - log_nvir[rows, j], out=log_nvir_out)
+        log_nvir_out += log_nvir[rows, j]
+        return 10 ** log_nvir_out
     
-    def func_solve(self, logMs, z, n_vir):
+    def _log_nvir_table(self, z_array):
+        """
+        Tabulate log10(nvir) on the MassFunction mass grid at each redshift,
+        so that the per-key work only needs interpolations.
+
+        :param z_array: array, redshifts
+        :return: tuple (log10 M grid, array of log10 nvir with one row per z)
+        """
+        log_m = np.log10(self._mass_function(z_array[0]).m)
+        log_nvir = np.empty((len(z_array), log_m.size))
+        # As in SHAM, nvir underflows to zero at the high-mass end of the
+        # grid (already inside hmf's ngtm), where its log10 is -inf
+        with np.errstate(divide='ignore'):
+            for i, z in enumerate(z_array):
+                mf = self._mass_function(z)
+                nvir_grid = hal.Total_cumulative_halo_function(log_m, mf.ngtm, z, self.h_0)
+                log_nvir[i] = np.log10(nvir_grid)
+        return log_m, log_nvir
+
+    def _process_key(self, logMvir0, z_array, dw_array, nvir_table, gsmf_table):
+        """
+        Per-key part of compute_values: progenitor masses, their nvir and the
+        matching logMs along z_array. Only takes picklable inputs so it can
+        run in a worker process.
+
+        :param logMvir0: float, log10(Mvir) of the halo at z0
+        :param z_array: array, redshifts
+        :param dw_array: array, growth-factor term (see hal.precompute_dw)
+        :param nvir_table: tuple (log_m, log_nvir) from _log_nvir_table
+        :param gsmf_table: tuple (logMs_grid, log_int) from _log_gsmf_table
+        :return: tuple of arrays (prog, nvir, logMs)
+        """
+        prog = hal.apply_fit(logMvir0, dw_array, hal.x_progenitors, self.h_0)
+        nvir = self.hmf_vec(z_array, prog, table=nvir_table)
+        logMs = self.SHAM_ste_grid(nvir, gsmf_table)
+        return prog, nvir, logMs
+
+    def func_solve(self, logMs, z, n_vir, gsmf_mode=_GSMF_MODE):
         """
         Helper function for SHAM_ste, comparing the halo number density 
         with integrated GSMF.
@@ -123,29 +232,102 @@ class MassFunctionCalculator:
         :param logMs: float, log10(stellar mass)
         :param z: float, redshift
         :param n_vir: float, halo number density
+        :param gsmf_mode: str, GSMF mode (see smf.gsmf_params)
         :return: float, difference between log(n_vir) and log(GSMF)
         """
         # Compare log n_vir vs log (integrated GSMF)
         return np.log10(n_vir) - np.log10(
-            smf.integrate_phi_GSMF(logMs, z, "deconvolved_including_halo_dispersion")
+            smf.integrate_phi_GSMF(logMs, z, gsmf_mode)
         )
     
-    def SHAM_ste(self, z, n_vir):
+    def SHAM_ste(self, z, n_vir, gsmf_mode=_GSMF_MODE):
         """
-        Bisect function to find logMs such that the integrated GSMF 
-        matches the given halo number density.
+        Find logMs such that the integrated GSMF matches the given halo
+        number density. Scalar form of SHAM_ste_vec.
 
         :param z: float, redshift
         :param n_vir: float, halo number density
+        :param gsmf_mode: str, GSMF mode (see smf.gsmf_params)
         :return: float, log10(stellar mass)
         """
-        return opt.bisect(
-            lambda logMs: self.func_solve(logMs, z, n_vir),
-            a=1,
-            b=12.5
-        )
-    
-    def compute_values(self, num_samples=100):
+        return float(self.SHAM_ste_vec(z, n_vir, gsmf_mode=gsmf_mode))
+
+    def SHAM_ste_vec(self, z, n_vir, n_iter=None, gsmf_mode=_GSMF_MODE):
+        """
+        Vectorized counterpart of SHAM_ste for (z, n_vir) pairs: tabulates
+        the integrated GSMF at each z and inverts it with SHAM_ste_grid.
+
+        :param z: array-like, redshifts
+        :param n_vir: array-like, halo number densities (same shape as z)
+        :param n_iter: unused; the inversion no longer bisects. Kept so that
+                       existing calls still work
+        :param gsmf_mode: str, GSMF mode (see smf.gsmf_params)
+        :return: array, log10(stellar mass) for each pair
+        """
+        z, n_vir = np.broadcast_arrays(np.asarray(z, dtype=float),
+                                       np.asarray(n_vir, dtype=float))
+        table = self._log_gsmf_table(z.ravel(), gsmf_mode=gsmf_mode)
+        return self.SHAM_ste_grid(n_vir.ravel(), table).reshape(z.shape)
+
+    def SHAM_ste_grid(self, n_vir, table):
+        """
+        Stellar-halo abundance matching for halo number densities sampled on
+        the redshifts of a _log_gsmf_table: n_vir[j] is matched by inverting
+        column j of the table (linear interpolation in log10 of the
+        integrated GSMF), for all columns at once and without root finding.
+
+        :param n_vir: array, halo number densities, one per table column
+        :param table: tuple (logMs_grid, log10 integrated GSMF) from _log_gsmf_table
+        :return: array, log10(stellar mass) for each n_vir (NaN where n_vir
+                 is NaN or not positive, as in SHAM)
+        """
+        logMs_grid, log_int = table
+        n_vir = np.asarray(n_vir, dtype=float)
+        logMs = np.full(n_vir.shape, np.nan)
+
+        # Only positive densities can be matched; the others are left as NaN
+        cols = np.flatnonzero(n_vir > 0)
+        log_nvir = np.log10(n_vir[cols])
+        log_int = log_int[:, cols]
+
+        # Each column decreases with logMs; at high z its top end can
+        # underflow to -inf, so the lowest n_vir it can match is its smallest
+        # finite value. Out-of-range densities raise, as the root finding did.
+        lowest = np.where(np.isfinite(log_int), log_int, np.inf).min(axis=0)
+        if np.any(log_nvir > log_int[0]) or np.any(log_nvir < lowest):
+            raise ValueError(
+                "A value of n_vir is outside the range of the integrated GSMF table."
+            )
+
+        # Last grid point whose integral is still >= n_vir, then interpolate
+        # between it and the next one
+        i = np.minimum((log_int >= log_nvir).sum(axis=0) - 1, logMs_grid.size - 2)
+        j = np.arange(cols.size)
+        y0 = log_int[i, j]
+        y1 = log_int[i + 1, j]
+        t = (log_nvir - y0) / (y1 - y0)
+        logMs[cols] = logMs_grid[i] + t * (logMs_grid[i + 1] - logMs_grid[i])
+        return logMs
+
+    def _log_gsmf_table(self, z_array, N=4096, gsmf_mode=_GSMF_MODE):
+        """
+        Tabulate log10 of the GSMF integrated from logMs up to 13, on a logMs
+        grid over [1, 13), with one column per redshift (see
+        smf.integrate_phi_GSMF_grid).
+
+        :param z_array: array, redshifts
+        :param N: int, number of logMs grid points over [1, 13]
+        :param gsmf_mode: str, GSMF mode (see smf.gsmf_params)
+        :return: tuple (logMs grid, array of shape (N - 1, len(z_array)))
+        """
+        logMs_grid = np.linspace(1.0, 13.0, N)
+        log_int = smf.integrate_phi_GSMF_grid(logMs_grid, z_array, gsmf_mode)
+        # The last point is the upper integration limit itself, where the
+        # integral is 0 and its log10 is -inf: leave it out of the table
+        return logMs_grid[:-1], log_int[:-1]
+
+    def compute_values(self, num_samples=100, max_workers=1, return_arrays=False,
+                       gsmf_mode=_GSMF_MODE):
         """
         High-level method that:
           1) Computes galaxy number densities for various logMs thresholds,
@@ -153,19 +335,33 @@ class MassFunctionCalculator:
           3) Builds an array of redshifts,
           4) Finds the progenitors for each initial halo mass,
           5) Computes corresponding nvir and logMs at those redshifts.
+             One cached MassFunction is used per redshift, instead of one
+             per (key, z) point.
 
         :param num_samples: int, number of points in the z array
-        :return: dict containing computed results for each key ('9', '9p5', '10', etc.)
-        """
-        # 1) Compute galaxy densities at z0
-        ngal_values = {
-            '9': smf.integrate_phi_GSMF(9,   self.z0, "deconvolved_including_halo_dispersion"),
-            '9p5': smf.integrate_phi_GSMF(9.5, self.z0, "deconvolved_including_halo_dispersion"),
-            '10': smf.integrate_phi_GSMF(10,  self.z0, "deconvolved_including_halo_dispersion"),
-            '10p5': smf.integrate_phi_GSMF(10.5, self.z0, "deconvolved_including_halo_dispersion"),
-            '11': smf.integrate_phi_GSMF(11,  self.z0, "deconvolved_including_halo_dispersion"),
-            '11p5': smf.integrate_phi_GSMF(11.5, self.z0, "deconvolved_including_halo_dispersion")
-        }
+        :param max_workers: int or None, number of worker processes used for
+                            the keys (None: one per key, up to the CPU count).
+                            The default 1 runs everything in the current
+                            process: each key only takes a few interpolations
+                            on the shared tables, which is cheaper than
+                            sending those tables to worker processes
+        :param return_arrays: bool, also return the underlying 2D arrays
+        :param gsmf_mode: str, GSMF used for the galaxy densities and the
+                          abundance matching (see smf.gsmf_params); the
+                          default "observed_smf" is the one of the
+                          reference curves
+        :return: dict containing computed results for each key ('9', '9p5', '10', etc.);
+                 if return_arrays, a tuple (results, arrays) where arrays holds
+                 'keys', 'z' and the (n_keys, num_samples) arrays 'prog',
+                 'nvir' and 'logMs', row i belonging to keys[i] (e.g. for a
+                 single np.savetxt of all keys)
+        """
+        # 1) Compute galaxy densities at z0, all thresholds in one
+        #    vectorized integration
+        keys = ['9', '9p5', '10', '10p5', '11', '11p5']
+        logMs_thresholds = np.array([9, 9.5, 10, 10.5, 11, 11.5])
+        ngal = smf.integrate_phi_GSMF(logMs_thresholds, self.z0, gsmf_mode)
+        ngal_values = dict(zip(keys, ngal))
         
         # 2) Compute the initial logMvir for each threshold
         initial_logMvir = {
@@ -173,28 +369,66 @@ class MassFunctionCalculator:
         }
         
         # 3) Build an array of redshifts (from z0 to something higher)
-        #    Here we logspace from (z0+1) to 12, then subtract 1
-        z_array = np.logspace(np.log10(self.z0 + 1), np.log10(12), num_samples) - 1
+        #    Here (1+z) is log-spaced from (z0+1) to 12; expm1 avoids the
+        #    cancellation of subtracting 1 near z0, and the first point is
+        #    set to exactly z0
+        z_array = np.expm1(np.linspace(np.log1p(self.z0), np.log(12.0), num_samples))
+        z_array[0] = self.z0
         
-        # 4) For each key, compute the progenitors and the associated nvir, logMs
-        results = {}
-        for key, logMvir0 in initial_logMvir.items():
-            # median_log10Mvir_progenitors is a placeholder function in halo_assembly
-            prog = hal.median_log10Mvir_progenitors(
-                logMvir0, self.z0, z_array, self.Cosmology
-            )
-            
-            # Compute nvir for each redshift in z_array
-            nvir = np.array([self.hmf(z, prog[i]) for i, z in enumerate(z_array)])
-            
-            # Use SHAM_ste to find the corresponding logMs
-            logMs = np.array([self.SHAM_ste(z, nvir[i]) for i, z in enumerate(z_array)])
-            
-            results[key] = {
+        # 4) The growth-factor term of the progenitor fit, the nvir tables and
+        #    the integrated GSMF tables depend only on z_array, so they are
+        #    computed once for all keys
+        dw_array = hal.precompute_dw(
+            self.Cosmology[1], self.Cosmology[2], self.Cosmology[6], self.z0, z_array
+        )
+        nvir_table = self._log_nvir_table(z_array)
+        gsmf_table = self._log_gsmf_table(z_array, gsmf_mode=gsmf_mode)
+        
+        # 5) For each key, compute the progenitors and the associated nvir,
+        #    logMs. Keys are independent, so they can run in worker processes.
+        #    Outputs go into rows of contiguous (n_keys, num_samples) arrays
+        n_keys = len(keys)
+        prog_arr = np.empty((n_keys, num_samples))
+        nvir_arr = np.empty_like(prog_arr)
+        logMs_arr = np.empty_like(prog_arr)
+        
+        if max_workers is None:
+            max_workers = min(n_keys, os.cpu_count() or 1)
+        
+        if max_workers > 1:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    executor.submit(self._process_key, initial_logMvir[key],
+                                    z_array, dw_array, nvir_table, gsmf_table): i
+                    for i, key in enumerate(keys)
+                }
+                for f in as_completed(futures):
+                    i = futures[f]
+                    prog_arr[i], nvir_arr[i], logMs_arr[i] = f.result()
+        else:
+            for i, key in enumerate(keys):
+                prog_arr[i], nvir_arr[i], logMs_arr[i] = self._process_key(
+                    initial_logMvir[key], z_array, dw_array, nvir_table, gsmf_table
+                )
+        
+        # Per-key dict view of the arrays (rows are views, not copies)
+        results = {
+            key: {
                 'z': z_array,
-                'nvir': nvir,
-                'logMs': logMs,
-                'prog': prog
+                'nvir': nvir_arr[i],
+                'logMs': logMs_arr[i],
+                'prog': prog_arr[i]
             }
+            for i, key in enumerate(keys)
+        }
         
+        if return_arrays:
+            arrays = {
+                'keys': keys,
+                'z': z_array,
+                'prog': prog_arr,
+                'nvir': nvir_arr,
+                'logMs': logMs_arr
+            }
+            return results, arrays
         return results
\ No newline at end of file
@@ -7,17 +7,31 @@ This version preserves all essential functions from the original code:
  - Star-forming (SF) galaxy functions: log_phi_SF, alpha_SF, beta_SF, etc.
  - Quiescent (Q) galaxy functions: log_phi_1_Q, log_phi_2_Q, etc.
  - Combined GSMF: phi_GSMF_SF and phi_GSMF_Q
- - High-level entry points: phi_GSMF() and integrate_phi_GSMF()
+ - High-level entry points: phi_GSMF(), phi_GSMF_array(), integrate_phi_GSMF()
+ - Redshift-batched tables: phi_GSMF_grid() and integrate_phi_GSMF_grid()
 
 """
 
 import numpy as np
 from . import halo_assembly as hal
-from scipy.integrate import quad
+from .utils import njit
+from scipy.integrate import cumulative_trapezoid
+
+# ln(10), so that 10**y can be evaluated as exp(LN10 * y)
+LN10 = np.log(10.0)
+
+# log10(e), the factor to convert ln -> log10, and its own log10
+_LOG10_E = 0.4342944819032518
+_LOG10_LOG10_E = np.log10(_LOG10_E)
+
+# Nodes and weights of the fixed-order Gauss-Legendre rule on [-1, 1]
+# used by integrate_phi_GSMF
+_GL_NODES, _GL_WEIGHTS = np.polynomial.legendre.leggauss(48)
 
 ###############################################################################
 # 1) Helper function for parameter evolution
 ###############################################################################
+@njit(cache=True, fastmath=True)
 def Z_func_RP20(p0, p1, p2, p3, z):
     """
     Computes a redshift-dependent function used in various GSMF parameters.
@@ -27,10 +41,11 @@ def Z_func_RP20(p0, p1, p2, p3, z):
     :param z: float, redshift
     :return: float, evaluated function value
     """
+    sc = 1.0 / (1.0 + z)
     return (
         p0
-        + p1 * (1.0 - hal.scale_factor(z))
-        + p2 * np.log10(hal.scale_factor(z))
+        + p1 * (1.0 - sc)
+        + p2 * np.log10(sc)
         + p3 * z
     )
 
@@ -40,6 +55,7 @@ def Z_func_RP20(p0, p1, p2, p3, z):
 #    for star-forming galaxies, including a second population (SF2) if needed.
 ###############################################################################
 
+@njit(cache=True, fastmath=True)
 def log_phi_SF(x, z):
     """
     Logarithm of the normalization (phi*) for the first SF population.
@@ -61,6 +77,7 @@ def log_phi_SF2(x, z):
     """
     return log_phi_SF(x, z) + x[20]
 
+@njit(cache=True, fastmath=True)
 def alpha_SF(x, z):
     """
     Low-mass slope (alpha) of the SF GSMF.
@@ -82,6 +99,7 @@ def alpha_SF2(x, z):
     """
     return alpha_SF(x, z) + 1.0
 
+@njit(cache=True, fastmath=True)
 def beta_SF(x, z):
     """
     High-mass cutoff (beta) for the SF GSMF.
@@ -93,6 +111,7 @@ def beta_SF(x, z):
     beta_s = Z_func_RP20(x[8], 0.0, 0.0, 0.0, z)
     return beta_s
 
+@njit(cache=True, fastmath=True)
 def log10Mchar_SF(x, z):
     """
     Characteristic mass, log10(Mchar), for the SF GSMF.
@@ -186,6 +205,7 @@ def beta_3_Q(x, z):
 # 4) Core Schechter Function
 ###############################################################################
 
+@njit(cache=True, fastmath=True)
 def generalized_schechter_function(phi, alpha, beta, log10Mchar, log10Ms):
     """
     Computes the number density at log10Ms given a generalized Schechter function:
@@ -199,21 +219,68 @@ def generalized_schechter_function(phi, alpha, beta, log10Mchar, log10Ms):
     :return: float, the number density [Mpc^-3 dex^-1], in linear space
     """
     x_ratio = log10Ms - log10Mchar
-    base_change = np.log10(np.exp(1.0))  # factor to convert ln->log10
 
-    # phi_star = phi + (alpha+1)*x_ratio - 10^(beta*x_ratio)*base_change - log10(base_change)
+    # phi_star = phi + (alpha+1)*x_ratio - 10^(beta*x_ratio)*log10(e) - log10(log10(e))
     phi_star = (
         phi
         + (alpha + 1.0) * x_ratio
-        - 10.0 ** (beta * x_ratio) * base_change
-        - np.log10(base_change)
+        - np.exp(LN10 * beta * x_ratio) * _LOG10_E
+        - _LOG10_LOG10_E
     )
-    return 10.0 ** phi_star
+    return np.exp(LN10 * phi_star)
 
 ###############################################################################
 # 5) Star-Forming and Quiescent GSMF Calculation
 ###############################################################################
 
+def sf_components(x, z):
+    """
+    Parameters of the two star-forming Schechter components (SF1, SF2).
+    Shared quantities (beta_SF, log10Mchar_SF, ...) are evaluated only once;
+    the formulas are those of log_phi_SF2, alpha_SF2, etc.
+
+    :param x: array-like, fit parameters
+    :param z: float or array, redshift
+    :return: list of (phi, alpha, beta, log10Mchar) tuples
+    """
+    phi_s1 = log_phi_SF(x, z)
+    alpha_s1 = alpha_SF(x, z)
+    beta_s = beta_SF(x, z)
+    logMc = log10Mchar_SF(x, z)
+
+    return [
+        (phi_s1,         alpha_s1,       beta_s, logMc),   # SF1
+        (phi_s1 + x[20], alpha_s1 + 1.0, beta_s, logMc),   # SF2
+    ]
+
+def q_components(x, z):
+    """
+    Parameters of the three quiescent Schechter components (Q1, Q2, Q3).
+    Shared quantities (alpha_SF, beta_SF, log10Mchar_SF, log_phi_2_Q, ...)
+    are evaluated only once; the formulas are those of log_phi_1_Q,
+    alpha_2_Q, log10Mchar_2_Q, etc.
+
+    :param x: array-like, fit parameters
+    :param z: float or array, redshift
+    :return: list of (phi, alpha, beta, log10Mchar) tuples
+    """
+    sc = 1.0 / (1.0 + z)
+    alpha_s = alpha_SF(x, z)
+    beta_s = beta_SF(x, z)
+    logMc_SF = log10Mchar_SF(x, z)
+
+    phi_2 = log_phi_2_Q(x, z)
+    phi_1 = phi_2 + Z_func_RP20(x[13], -2.0, 0.0, 0.0, z)
+    phi_3 = phi_2 + x[21]
+    alpha_2 = alpha_s + 2.0 - sc
+    logMc_2 = logMc_SF + Z_func_RP20(x[18], x[19], 0.0, 0.0, z)
+
+    return [
+        (phi_1, alpha_s, beta_s,         logMc_SF),   # Q1
+        (phi_2, alpha_2, beta_s,         logMc_2),    # Q2
+        (phi_3, alpha_2, beta_s + x[22], logMc_2),    # Q3: same alpha and Mchar as Q2
+    ]
+
 def phi_GSMF_SF(x, logMs, z):
     """
     Computes the total star-forming (SF) GSMF at logMs, z, 
@@ -224,23 +291,10 @@ def phi_GSMF_SF(x, logMs, z):
     :param z: float, redshift
     :return: float, combined SF number density
     """
-    # First SF component
-    phi_s1  = log_phi_SF(x, z)
-    alpha_s1 = alpha_SF(x, z)
-    beta_s1  = beta_SF(x, z)
-    logMc1   = log10Mchar_SF(x, z)
-
-    # Second SF component
-    phi_s2   = log_phi_SF2(x, z)
-    alpha_s2 = alpha_SF2(x, z)
-    beta_s2  = beta_SF(x, z)
-    logMc2   = log10Mchar_SF(x, z)
-
-    # Evaluate each Schechter function
-    phi_SF_1 = generalized_schechter_function(phi_s1, alpha_s1, beta_s1, logMc1, logMs)
-    phi_SF_2 = generalized_schechter_function(phi_s2, alpha_s2, beta_s2, logMc2, logMs)
-
-    return phi_SF_1 + phi_SF_2
+    return sum(
+        generalized_schechter_function(phi, alpha, beta, logMc, logMs)
+        for phi, alpha, beta, logMc in sf_components(x, z)
+    )
 
 def phi_GSMF_Q(x, logMs, z):
     """
@@ -252,35 +306,70 @@ def phi_GSMF_Q(x, logMs, z):
     :param z: float, redshift
     :return: float, combined Q number density
     """
-    # Q1
-    phi_1   = log_phi_1_Q(x, z)
-    alpha_1 = alpha_1_Q(x, z)
-    beta_1  = beta_1_Q(x, z)
-    logMc1  = log10Mchar_1_Q(x, z)
-
-    # Q2
-    phi_2   = log_phi_2_Q(x, z)
-    alpha_2 = alpha_2_Q(x, z)
-    beta_2  = beta_2_Q(x, z)
-    logMc2  = log10Mchar_2_Q(x, z)
-
-    # Q3
-    phi_3   = log_phi_3_Q(x, z)
-    alpha_3 = alpha_2_Q(x, z)  # same alpha as Q2?
-    beta_3  = beta_3_Q(x, z)
-    logMc3  = log10Mchar_2_Q(x, z)  # same Mchar as Q2?
+    return sum(
+        generalized_schechter_function(phi, alpha, beta, logMc, logMs)
+        for phi, alpha, beta, logMc in q_components(x, z)
+    )
 
-    # Evaluate each Schechter function
-    phi_Q_1 = generalized_schechter_function(phi_1, alpha_1, beta_1, logMc1, logMs)
-    phi_Q_2 = generalized_schechter_function(phi_2, alpha_2, beta_2, logMc2, logMs)
-    phi_Q_3 = generalized_schechter_function(phi_3, alpha_3, beta_3, logMc3, logMs)
+def schechter_components(x, z):
+    """
+    Evaluates the parameters of all five generalized Schechter components
+    (SF1, SF2, Q1, Q2, Q3) once for redshift z.
 
-    return phi_Q_1 + phi_Q_2 + phi_Q_3
+    :param x: array-like, fit parameters
+    :param z: float or array, redshift
+    :return: list of (phi, alpha, beta, log10Mchar) tuples, one per component
+    """
+    return sf_components(x, z) + q_components(x, z)
 
 ###############################################################################
 # 6) High-Level GSMF Interface
 ###############################################################################
 
+# Fit parameters for each GSMF mode, built once at import time and read-only
+_PARAMS = {
+    "observed_smf": np.array([
+        0, -2.97903, 0.711457, 2.13684, -0.143942,
+        -1.43664, -0.182969, -0.0652577, 0.924276, 10.3495,
+        -0.852267, -3.43822, -0.294256, -0.687046, -2.64856,
+        -0.22453, -2.01024, -0.9555, 0.469221, -1.03017,
+        0.386681, -0.782124, -0.292956
+    ]),
+    "true_smf": np.array([
+        0, -3.12587, 1.0149, 2.96305, 0.0322943,
+        -1.5068, -0.0962951, -0.0678136, 0.984965, 10.4309,
+        -0.936285, -3.60355, -0.439795, -0.789231, -2.6914,
+        -0.0222751, -1.59791, -0.877709, 0.431888, -0.762424,
+        0.531231, -0.748871, -0.326509
+    ]),
+    "intrinsic_smf": np.array([
+        0, -3.13858, 0.776621, 2.46962, 0.0151814,
+        -1.50836, -0.0840718, -0.0680439, 1.01977, 10.4759,
+        -0.936793, -3.48557, -0.447515, -0.861007, -2.65967,
+        -0.0227114, -1.49839, -0.849498, 0.351052, -0.582103,
+        0.502357, -0.876961, -0.352607
+    ]),
+}
+for _param in _PARAMS.values():
+    _param.setflags(write=False)
+del _param
+
+def gsmf_params(choose_mode):
+    """
+    Returns the array of fit parameters for a given GSMF mode.
+
+    :param choose_mode: str, one of {"observed_smf", "true_smf", 
+                                     "intrinsic_smf"}
+    :return: np.ndarray (read-only), the 23 fit parameters of that mode
+    """
+    try:
+        return _PARAMS[choose_mode]
+    except KeyError:
+        raise ValueError(
+            "No valid mode selected; choose between 'observed_smf', "
+            "'true_smf', or 'intrinsic_smf'."
+        ) from None
+
 def phi_GSMF(logMs, z, choose_mode):
     """
     High-level function to compute the total GSMF (SF + Q) at logMs, z,
@@ -294,49 +383,86 @@ def phi_GSMF(logMs, z, choose_mode):
                                      "intrinsic_smf"}
     :return: float, total GSMF (SF + Q) at logMs, z
     """
-    if choose_mode == "observed_smf":
-        param = np.array([
-            0, -2.97903, 0.711457, 2.13684, -0.143942,
-            -1.43664, -0.182969, -0.0652577, 0.924276, 10.3495,
-            -0.852267, -3.43822, -0.294256, -0.687046, -2.64856,
-            -0.22453, -2.01024, -0.9555, 0.469221, -1.03017,
-            0.386681, -0.782124, -0.292956
-        ])
-    elif choose_mode == "true_smf":
-        param = np.array([
-            0, -3.12587, 1.0149, 2.96305, 0.0322943,
-            -1.5068, -0.0962951, -0.0678136, 0.984965, 10.4309,
-            -0.936285, -3.60355, -0.439795, -0.789231, -2.6914,
-            -0.0222751, -1.59791, -0.877709, 0.431888, -0.762424,
-            0.531231, -0.748871, -0.326509
-        ])
-    elif choose_mode == "intrinsic_smf":
-        param = np.array([
-            0, -3.13858, 0.776621, 2.46962, 0.0151814,
-            -1.50836, -0.0840718, -0.0680439, 1.01977, 10.4759,
-            -0.936793, -3.48557, -0.447515, -0.861007, -2.65967,
-            -0.0227114, -1.49839, -0.849498, 0.351052, -0.582103,
-            0.502357, -0.876961, -0.352607
-        ])
-    else:
-        raise ValueError(
-            "No valid mode selected; choose between 'observed_smf', "
-            "'true_smf', or 'intrinsic_smf'."
-        )
+    param = gsmf_params(choose_mode)
 
     # Sum quiescent + star-forming
     return phi_GSMF_Q(param, logMs, z) + phi_GSMF_SF(param, logMs, z)
 
+def phi_GSMF_array(logMs, z, choose_mode):
+    """
+    Same as phi_GSMF, but meant for a whole array of logMs: the Schechter
+    parameters are computed once and each component is evaluated on the
+    full array in a single NumPy expression.
+
+    :param logMs: array-like, log10(stellar mass)
+    :param z: float or array broadcastable against logMs, redshift
+    :param choose_mode: str, one of the three GSMF modes
+    :return: array, total GSMF (SF + Q) at each logMs
+    """
+    param = gsmf_params(choose_mode)
+    logMs = np.asarray(logMs, dtype=float)
+
+    total = np.zeros(np.broadcast(logMs, z).shape)
+    for phi, alpha, beta, logMc in schechter_components(param, z):
+        total += generalized_schechter_function(phi, alpha, beta, logMc, logMs)
+    return total
+
 def integrate_phi_GSMF(logM_i, z, choose_mode):
     """
     Integrates the GSMF from logM_i to 13 (i.e., from 10^logM_i up to 10^13 Msun).
+    The integrand is smooth on that interval, so a fixed 48-point
+    Gauss-Legendre rule is used: one phi_GSMF_array evaluation per bound,
+    and whole arrays of (logM_i, z) pairs are integrated at once.
 
-    :param logM_i: float, lower bound for integration in log10(M)
-    :param z: float, redshift
+    :param logM_i: float or array, lower bound for integration in log10(M)
+    :param z: float or array broadcastable against logM_i, redshift
+    :param choose_mode: str, one of the three GSMF modes
+    :return: float or array, integrated number density (units of Mpc^-3)
+    """
+    logM_i = np.asarray(logM_i, dtype=float)
+    half = 0.5 * (13.0 - logM_i)
+    mid = 0.5 * (13.0 + logM_i)
+
+    # Quadrature nodes along a trailing axis of length 48
+    xs = mid[..., None] + half[..., None] * _GL_NODES
+    z = np.asarray(z, dtype=float)[..., None]
+    result = half * (phi_GSMF_array(xs, z, choose_mode) @ _GL_WEIGHTS)
+    return result[()]
+
+def phi_GSMF_grid(logMs_grid, z_array, choose_mode):
+    """
+    Evaluates the GSMF on every (logMs, z) pair of a logMs grid and a
+    redshift array. The Schechter parameters are computed once for the
+    whole z_array and broadcast against the grid.
+
+    :param logMs_grid: 1-D array, log10(stellar mass) grid
+    :param z_array: 1-D array, redshifts
     :param choose_mode: str, one of the three GSMF modes
-    :return: float, integrated number density (units of Mpc^-3)
+    :return: array of shape (len(logMs_grid), len(z_array))
     """
-    # We integrate phi_GSMF(logMs) d(logMs) from logM_i to 13
-    result, error = quad(lambda logMs: phi_GSMF(logMs, z, choose_mode),
-                         logM_i, 13)
-    return result
\ No newline at end of file
+    logMs_grid = np.asarray(logMs_grid, dtype=float)
+    z_array = np.asarray(z_array, dtype=float)
+    return phi_GSMF_array(logMs_grid[:, None], z_array[None, :], choose_mode)
+
+def integrate_phi_GSMF_grid(logMs_grid, z_array, choose_mode):
+    """
+    Tabulates the GSMF integral from each grid point up to the last one
+    (13 for the grids used in this package), for every redshift at once.
+    phi_GSMF_grid is integrated with the trapezoidal rule along the logMs
+    axis, accumulating from the top so the high-mass tail keeps its
+    precision.
+
+    :param logMs_grid: 1-D increasing array, log10(stellar mass) grid
+    :param z_array: 1-D array, redshifts
+    :param choose_mode: str, one of the three GSMF modes
+    :return: array of shape (len(logMs_grid), len(z_array)), log10 of the
+             integrated number density; column j belongs to z_array[j].
+             The last row (an empty integral) is -inf, as are the top rows
+             of columns where phi underflows to 0
+    """
+    logMs_grid = np.asarray(logMs_grid, dtype=float)
+    phi = phi_GSMF_grid(logMs_grid, z_array, choose_mode)
+    from_right = -cumulative_trapezoid(phi[::-1], logMs_grid[::-1],
+                                       axis=0, initial=0.0)[::-1]
+    with np.errstate(divide='ignore'):
+        return np.log10(from_right)
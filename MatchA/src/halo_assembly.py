@@ -6,7 +6,10 @@ and subhalo corrections. This streamlined version maintains core functionality
 redundancies or purely unused code. Comments are in English.
 """
 
+from functools import lru_cache
+
 import numpy as np
+from .utils import njit
 
 ############################
 # CONSTANTS
@@ -15,22 +18,17 @@ H0    = 100.0   # Hubble constant in km/s/Mpc (if needed for dimension checks)
 h_BP  = 0.678   # Baseline h parameter for reference scaling
 logM13 = 13.0   # log10(1e13 Msun) used in some empirical fits
 
+# Fitting parameters of median_log10Mvir_progenitors
+# (taken from some reference or prior calibration)
+x_progenitors = np.array([0., 1.52947, -3.4087, -0.404274,
+                          0.285509, 11.9943, 0.143375, 4.07574])
+x_progenitors.setflags(write=False)
+
 ############################
 # BASIC COSMOLOGY / HELPER FUNCTIONS
 ############################
 
-def Om_m(Om_mat, Om_lambda, z):
-    """
-    Computes Omega_m(z) = Om_mat*(1+z)^3 / [Om_lambda + Om_mat*(1+z)^3].
-    """
-    return Om_mat * (1. + z)**3 / (Om_lambda + Om_mat * (1. + z)**3)
-
-def Om_l(Om_mat, Om_lambda, z):
-    """
-    Computes Omega_lambda(z) = Om_lambda / [Om_lambda + Om_mat*(1+z)^3].
-    """
-    return Om_lambda / (Om_lambda + Om_mat * (1. + z)**3)
-
+@njit(cache=True, fastmath=True)
 def g_factor(Om_m_val, Om_l_val, z):
     """
     Helper function for D_gfactor. Empirical expression 
@@ -45,14 +43,23 @@ def g_factor(Om_m_val, Om_l_val, z):
         + (1. + Om_m_val * 0.5) * (1. + Om_l_val * 0.014285714)
     )
 
+def _om_mz_olz(Om_mat, Om_lambda, z):
+    """
+    Computes Omega_m(z) and Omega_lambda(z) together, sharing the
+    Om_mat*(1+z)^3 term and the denominator between both.
+    """
+    e = Om_mat * (1. + z)**3
+    d = Om_lambda + e
+    return e / d, Om_lambda / d
+
 def D_gfactor(Om_mat, Om_lambda, z):
     """
     Returns D(z)/D(0), the ratio of growth factors between redshift z and z=0.
     """
-    Om_m_z = Om_m(Om_mat, Om_lambda, z)
-    Om_l_z = Om_l(Om_mat, Om_lambda, z)
+    Om_m_z, Om_l_z = _om_mz_olz(Om_mat, Om_lambda, z)
     return g_factor(Om_m_z, Om_l_z, z) / g_factor(Om_mat, Om_lambda, 0)
 
+@njit(cache=True, fastmath=True)
 def scale_factor(z):
     """
     Simple function: a(z) = 1/(1+z).
@@ -61,45 +68,70 @@ def scale_factor(z):
     return 1.0 / (1.0 + z)
 
 ############################
-# FITTING FUNCTIONS FOR PROGENITOR EVOLUTION
+# MAIN FUNCTION: PROGENITOR MASSES
 ############################
 
-def f_norm(x, logMvir0, dw):
-    """
-    Part of the fitting function in median_log10Mvir_progenitors.
-    (1+dw)^alpha * (1+0.5*dw)^beta * exp(gamma*dw).
+def precompute_dw(Om_mat, Om_lambda, delta_c, z0, z):
     """
-    alpha = x[1]
-    beta  = x[2]
-    gamma = x[3]
-    return (1. + dw)**alpha * (1. + 0.5*dw)**beta * np.exp(gamma * dw)
+    Growth-factor term dw = delta_c/D(z) - delta_c/D(z0) used by the
+    progenitor fit. It depends only on cosmology and redshifts, so it can
+    be computed once and shared by every halo mass.
 
-def a0_func(x, logMvir0, scale):
-    """
-    Helper for f_func. 
-    x[4], x[5], x[6], x[7] are fitting parameters.
+    :param Om_mat: float, Omega_m at z=0
+    :param Om_lambda: float, Omega_lambda at z=0
+    :param delta_c: float, critical overdensity for collapse
+    :param z0: float, the reference redshift
+    :param z: array-like, the redshifts where we want the progenitor mass
+    :return: array of dw at each z
     """
-    ratio = x[5] - logMvir0
-    return x[4] - np.log10(10**(x[6] * ratio) + 1.)
+    return delta_c / D_gfactor(Om_mat, Om_lambda, z) - \
+           delta_c / D_gfactor(Om_mat, Om_lambda, z0)
 
-def g_func(x, logMvir0, dw):
+@njit(fastmath=True, cache=True)
+def _median_prog_kernel(logMvir0, dw_arr, x):
     """
-    Another piece of the empirical fit for f_func.
+    Fused kernel behind apply_fit. For each dw it evaluates the
+    normalization (1+dw)^alpha * (1+0.5*dw)^beta * exp(gamma*dw) and the
+    mass term (logMvir0 - 13) * g(0) / g(dw), with
+    g(dw) = 1 + exp(-x[7] * (1/(1+dw) - a0)), as scalar temporaries and
+    writes only the final log10(Mvir).
+    logMvir0 is expected to be already adjusted for h.
     """
-    sc = 1.0 / (1.0 + dw)  # scale factor ~ a(z)
-    d_scale = sc - a0_func(x, logMvir0, sc)
-    return 1. + np.exp(-x[7] * d_scale)
+    # dw-independent pieces, computed once outside the loop
+    a0 = x[4] - np.log10(10**(x[6] * (x[5] - logMvir0)) + 1.)
+    g_func_0 = 1. + np.exp(-x[7] * (1. - a0))
+
+    out = np.empty(dw_arr.size)
+    for i in range(dw_arr.size):
+        dw = dw_arr[i]
+        f_norm_val = (1. + dw)**x[1] * (1. + 0.5*dw)**x[2] * np.exp(x[3] * dw)
+        g_func_dw = 1. + np.exp(-x[7] * (1.0 / (1.0 + dw) - a0))
+        f_func_val = (logMvir0 - logM13) * g_func_0 / g_func_dw
+
+        out[i] = logM13 + np.log10(f_norm_val) + f_func_val
+    return out
 
-def f_func(x, logMvir0, dw):
+def apply_fit(logMvir0, dw_array, x, h):
     """
-    Ties together f_norm and g_func to form part of the 
-    median_log10Mvir_progenitors formula.
+    Evaluates the empirical progenitor fit for one halo mass on a
+    precomputed dw array (see precompute_dw).
+
+    :param logMvir0: float, log10 of Mvir at redshift z0
+    :param dw_array: array-like, growth-factor term at each redshift
+    :param x: array of fitting parameters (e.g. x_progenitors)
+    :param h: float, Hubble parameter
+    :return: array of log10(Mvir) at each redshift
     """
-    return (logMvir0 - logM13) * g_func(x, logMvir0, 0.) / g_func(x, logMvir0, dw)
+    # Adjust logMvir0 by the ratio (h/h_BP) if needed
+    logMvir0_adj = logMvir0 + np.log10(h / h_BP)
 
-############################
-# MAIN FUNCTION: PROGENITOR MASSES
-############################
+    dw_array = np.asarray(dw_array, dtype=float)
+    Mvirz_array = _median_prog_kernel(
+        logMvir0_adj, dw_array.ravel(), x
+    ).reshape(dw_array.shape)
+
+    # Re-adjust for h
+    return Mvirz_array - np.log10(h / h_BP)
 
 def median_log10Mvir_progenitors(log10Mh0, z0, z, Cosmology):
     """
@@ -113,43 +145,25 @@ def median_log10Mvir_progenitors(log10Mh0, z0, z, Cosmology):
                       [0, Om_mat, Om_lambda, Ob0, sigma8, h_0, delta_c]
     :return: array of log10(Mvir) at each z
     """
-    # Example array of fitting parameters (taken from some reference or prior calibration)
-    x = np.array([0., 1.52947, -3.4087, -0.404274, 
-                  0.285509, 11.9943, 0.143375, 4.07574])
-    
     Om_mat = Cosmology[1]
     Om_lambda = Cosmology[2]
     h = Cosmology[5]
     delta_c = Cosmology[6]  # might be used as part of dw
 
-    # Adjust log10Mh0 by the ratio (h/h_BP) if needed
-    log10Mh0_adj = log10Mh0 + np.log10(h / h_BP)
-
-    # Growth factor difference from z to z0
-    dw_array = delta_c / D_gfactor(Om_mat, Om_lambda, z) - \
-               delta_c / D_gfactor(Om_mat, Om_lambda, z0)
-
-    # Combine f_norm and f_func
-    first_term = np.log10(f_norm(x, log10Mh0_adj, dw_array))
-    second_term = f_func(x, log10Mh0_adj, dw_array)
-    Mvirz_array = logM13 + first_term + second_term
-
-    # Re-adjust for h
-    return Mvirz_array - np.log10(h / h_BP)
+    dw_array = precompute_dw(Om_mat, Om_lambda, delta_c, z0, z)
+    return apply_fit(log10Mh0, dw_array, x_progenitors, h)
 
 ############################
 # SUBHALO CORRECTIONS
 ############################
 
-def subhalos_correction_factor(logMpeak, z, h):
+def _sub_zpart_terms(z):
     """
-    Empirical subhalo correction factor for total cumulative halo function.
-    :param logMpeak: float, log10(peak mass)
-    :param z: float, redshift
-    :param h: float, Hubble parameter (like 0.678)
-    :return: float, factor representing subhalo contribution
+    Redshift-only part of the subhalo correction: normalization, cut-off
+    mass and slope.
+    :param z: float or array, redshift
+    :return: tuple (Normalization, logMcut_off, k)
     """
-    logMpeak_h = logMpeak + np.log10(h)
     z2 = z * z
     
     # Example expansions
@@ -165,8 +179,38 @@ def subhalos_correction_factor(logMpeak, z, h):
                    + 0.022034*z*z2 
                    - 0.001151*(z2**2))
 
-    ratio = logMpeak_h - logMcut_off
-    return Normalization * np.exp(-10**(0.220586 * ratio))
+    return Normalization, logMcut_off, 0.220586
+
+@lru_cache(maxsize=256)
+def _sub_zpart(z):
+    """
+    Cached _sub_zpart_terms for scalar redshifts, since the terms are needed
+    once per redshift; callers pass z as a Python float so that it is hashable.
+    :param z: float, redshift
+    :return: tuple (Normalization, logMcut_off, k)
+    """
+    return _sub_zpart_terms(z)
+
+def _sub_mpart(logMpeak, h, Normalization, logMcut_off, k):
+    """
+    Mass-dependent part of the subhalo correction, given the z-only terms
+    from _sub_zpart_terms.
+    """
+    ratio = logMpeak + np.log10(h) - logMcut_off
+    return Normalization * np.exp(-10**(k * ratio))
+
+def subhalos_correction_factor(logMpeak, z, h):
+    """
+    Empirical subhalo correction factor for total cumulative halo function.
+    :param logMpeak: float, log10(peak mass)
+    :param z: float, redshift
+    :param h: float, Hubble parameter (like 0.678)
+    :return: float, factor representing subhalo contribution
+    """
+    # Only scalar redshifts can be cached; float() also turns 0-d arrays
+    # and NumPy scalars into a hashable key
+    zpart = _sub_zpart(float(z)) if np.ndim(z) == 0 else _sub_zpart_terms(z)
+    return _sub_mpart(logMpeak, h, *zpart)
 
 def Total_cumulative_halo_function(logMpeak, n_vir, z, h):
     """
@@ -7,15 +7,125 @@ This module creates two plots:
 Now, if a key contains 'p', we replace 'p' with '.' in the legend text.
 """
 
+import os
+import sys
+from functools import lru_cache
+
+import matplotlib
+
+# Without a display (and no backend requested) use the non-interactive Agg
+# backend rather than probing for a GUI toolkit
+if (not os.environ.get('MPLBACKEND') and sys.platform.startswith('linux')
+        and not os.environ.get('DISPLAY') and not os.environ.get('WAYLAND_DISPLAY')):
+    matplotlib.use('Agg')
+
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
 import numpy as np
-from matplotlib.ticker import AutoMinorLocator
+from matplotlib.ticker import AutoMinorLocator, FixedLocator, FuncFormatter
+
+# tsdownsample is optional: without it long curves are thinned by taking
+# every n-th point instead of with LTTB
+try:
+    from tsdownsample import LTTBDownsampler
+except ImportError:
+    LTTBDownsampler = None
+
+# Major tick positions of the 1+z axes
+_X_TICKS = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11]
+
+# use_tex value the rc style was last applied with (None: not applied yet)
+_STYLE_USE_TEX = None
+
+def _apply_style(use_tex):
+    """
+    Sets the global rc style (LaTeX, font, axes thickness). The rcParams are
+    only changed on the first call or when use_tex changes, since each change
+    invalidates matplotlib's font/text caches.
+
+    :param use_tex: bool, render text with an external LaTeX installation
+    """
+    global _STYLE_USE_TEX
+    if _STYLE_USE_TEX == use_tex:
+        return
+    plt.rc('text', usetex=use_tex)
+    plt.rc('font', family='serif', size=35)
+    plt.rc('axes', linewidth=3)
+    _STYLE_USE_TEX = use_tex
+
+@lru_cache(maxsize=8)
+def _load_ref(filename, mtime):
+    """
+    Loads the reference data table. The column names come from the '#'
+    header line; np.loadtxt then parses the numeric rows (much faster than
+    genfromtxt). Cached on (filename, mtime), so an unchanged file is only
+    parsed once.
+
+    Rows are grouped by logMs_0, keyed on the integer number of tenths
+    round(10*logMs_0) rather than on the float itself, so that e.g. a value
+    stored as 9.4999999 still matches the key '9p5'.
+
+    :param filename: str, path to the data file
+    :param mtime: float, modification time of the file (part of the cache key)
+    :return: tuple (dict {column name: read-only 1D array}, rows sorted by
+             logMs_0, dict {tenths: slice of its rows})
+    """
+    with open(filename) as f:
+        names = f.readline().lstrip('#').split()
+    data = np.loadtxt(filename,
+                      dtype={'names': names, 'formats': [float] * len(names)})
+
+    # Sort by tenths of logMs_0 (a stable sort keeps the row order within a
+    # group) so that each group is a contiguous slice
+    tenths = np.round(data['logMs_0'] * 10).astype(np.int64)
+    order = np.argsort(tenths, kind='stable')
+    data = data[order]
+
+    # One contiguous (read-only) array per column
+    cols = {}
+    for name in names:
+        cols[name] = np.ascontiguousarray(data[name])
+        cols[name].setflags(write=False)
+
+    values, starts, counts = np.unique(tenths[order], return_index=True,
+                                       return_counts=True)
+    groups = {int(v): slice(int(start), int(start + count))
+              for v, start, count in zip(values, starts, counts)}
+    return cols, groups
+
+def _segment(x, y, max_points):
+    """
+    Builds the (N, 2) vertex array of one curve, downsampled to at most
+    max_points vertices (largest-triangle-three-buckets if tsdownsample is
+    installed, otherwise every n-th point plus the last one).
+
+    :param x: 1D array, abscissa (increasing)
+    :param y: 1D array, ordinate
+    :param max_points: int or None, maximum number of vertices (None: no limit)
+    :return: (N, 2) array of vertices
+    """
+    n = len(x)
+    if max_points is not None and n > max_points:
+        if LTTBDownsampler is not None:
+            idx = LTTBDownsampler().downsample(np.ascontiguousarray(x, dtype=float),
+                                               np.ascontiguousarray(y, dtype=float),
+                                               n_out=max_points)
+        else:
+            step = -(-n // max_points)
+            idx = np.arange(0, n, step)
+            if idx[-1] != n - 1:
+                idx[-1] = n - 1
+        x, y = x[idx], y[idx]
+    return np.column_stack((x, y))
 
 def plot_results(results,
                  keys,
                  data_filename='sham_lognormal_distributions.dat',
                  user_colors=None,
-                 colormap='viridis'):
+                 colormap='viridis',
+                 use_tex=False,
+                 max_points=5000):
     """
     Generates two plots:
       1) The cumulative halo number density (nvir) vs. (1+z)
@@ -27,19 +137,24 @@ def plot_results(results,
     :param user_colors: list of colors (e.g., [(R,G,B), ...] or ["#RRGGBB", ...]),
                         same length as 'keys', optional
     :param colormap: str, name of a matplotlib colormap (used if user_colors is None)
+    :param use_tex: bool, render text with an external LaTeX installation
+                    (slow on first draw); the default uses matplotlib's mathtext
+    :param max_points: int or None, curves longer than this are downsampled to
+                       max_points vertices before plotting (None: no limit)
+    :return: tuple (fig, (ax1, ax2)), a new figure on every call; it is not
+             shown, callers use fig.savefig(...) or plt.show(), and
+             plt.close(fig) when done
     """
 
     # -------------------------------------------------------------------------
     # 1) Set up the style for LaTeX, font, axes thickness, and ticks
     # -------------------------------------------------------------------------
-    plt.rc('text', usetex=True)
-    plt.rc('font', family='serif', size=35)
-    plt.rc('axes', linewidth=3)
+    _apply_style(use_tex)
     
     # -------------------------------------------------------------------------
-    # 2) Load data from file
+    # 2) Load data from file (cached until the file changes)
     # -------------------------------------------------------------------------
-    data = np.genfromtxt(data_filename, names=True)
+    cols, groups = _load_ref(data_filename, os.path.getmtime(data_filename))
     
     # -------------------------------------------------------------------------
     # 3) If user_colors is provided, it must match the length of keys.
@@ -51,91 +166,108 @@ def plot_results(results,
         color_list = user_colors
     else:
         cmap = plt.get_cmap(colormap, len(keys))
-        color_list = [cmap(i) for i in range(len(keys))]
+        color_list = cmap(np.arange(len(keys)))
     
-    # Map each key to a color
-    key_color_map = dict(zip(keys, color_list))
+    # Per-key (key, color, logMs_0 value, legend label), with 'p' replaced
+    # by '.' for the value and the label
+    info = []
+    for key, color in zip(keys, color_list):
+        key_label = key.replace('p', '.')
+        info.append((key, color, float(key_label), key_label))
     
     # -------------------------------------------------------------------------
-    # 4) Create a dictionary of data rows for each key
+    # 4) Create a dictionary of reference columns for each key
     # -------------------------------------------------------------------------
+    #    Keys are matched on tenths of logMs_0, which is robust to float
+    #    round-off and is a single dict lookup per key.
+    empty = slice(0, 0)
     data_dict = {}
-    for key in keys:
-        float_val = float(key.replace('p', '.'))
-        data_dict[key] = data[data['logMs_0'] == float_val]
+    for key, _, fval, _ in info:
+        rows = groups.get(round(fval * 10), empty)
+        data_dict[key] = {name: cols[name][rows]
+                          for name in ('z', 'logMs_prog_deconv_gsmf',
+                                       'ngal_eval_logMs_prog_deconv_gsmf')}
+    
+    #    Transform every curve once; both panels reuse the arrays:
+    #    (1+z, M*, 1+z_ref, M*_ref, n_ref)
+    precomp = {key: (1. + results[key]['z'],
+                     10 ** results[key]['logMs'],
+                     1. + data_dict[key]['z'],
+                     10 ** data_dict[key]['logMs_prog_deconv_gsmf'],
+                     data_dict[key]['ngal_eval_logMs_prog_deconv_gsmf'])
+               for key in keys}
     
     # -------------------------------------------------------------------------
     # 5) Create the figure and subplots (1 row, 2 columns)
     # -------------------------------------------------------------------------
-    fig, axs = plt.subplots(1, 2, figsize=(30, 15))
+    #    Data lines are rasterized (at the figure dpi) so that vector exports
+    #    stay small and fast to write; axes, labels and legends stay vector.
+    fig, axs = plt.subplots(1, 2, figsize=(30, 15), dpi=150, sharex=True)
     ax1, ax2 = axs
 
     for ax in axs:
         ax.tick_params(which="major", length=10, width=3, direction="out")
         ax.tick_params(which="minor", length=5, width=3, direction="out")
-        ax.xaxis.set_minor_locator(AutoMinorLocator())
+        ax.tick_params(axis='x', which='major', labelsize=35)
         ax.yaxis.set_minor_locator(AutoMinorLocator())
 
+    # Both panels share the logarithmic 1+z axis (scale, limits and tickers),
+    # so it is set up once, with ticks at 1, ..., 11 whose labels are
+    # formatted lazily, only for the ticks that are drawn
+    ax1.set_xscale("log")
+    ax1.xaxis.set_major_locator(FixedLocator(_X_TICKS))
+    ax1.xaxis.set_major_formatter(FuncFormatter(lambda x, _: f'${int(x)}$'))
+    ax1.set_xlim(1, 11)
+
     # -------------------------------------------------------------------------
     # 6) First plot: cumulative halo density (nvir) vs. (1 + z)
     # -------------------------------------------------------------------------
-    for key in keys:
-        res = results[key]
-        ax1.plot(1. + res['z'], res['nvir'], 
-                 color=key_color_map[key], ls='-', linewidth=4, zorder=2)
-        
-        ax1.plot(1. + data_dict[key]['z'], data_dict[key]['ngal_eval_logMs_prog_deconv_gsmf'], 
-                 color=key_color_map[key], ls=':', linewidth=4, zorder=2)
+    #    One LineCollection per line style instead of one Line2D per curve
+    colors = [color for _, color, _, _ in info]
+    model_segs = [_segment(precomp[key][0], results[key]['nvir'], max_points)
+                  for key in keys]
+    ref_segs = [_segment(precomp[key][2], precomp[key][4], max_points) for key in keys]
+    ax1.add_collection(LineCollection(model_segs, colors=colors, linewidths=4,
+                                      linestyles='-', rasterized=True))
+    ax1.add_collection(LineCollection(ref_segs, colors=colors, linewidths=4,
+                                      linestyles=':', rasterized=True))
     
-    # Example reference lines
-    first_key = keys[0]
-    M_ref = data_dict[first_key]
-    ax1.plot(10 ** M_ref['logMs_prog_deconv_gsmf'], 
-             10 ** M_ref['logMs_prog_deconv_gsmf'],
-             color='k', ls='-', linewidth=4, zorder=2,
-             label=r'${\rm Evolving\ halo\ cumulative\ number\ density}$')
-    ax1.plot(10 ** M_ref['logMs_prog_deconv_gsmf'], 
-             10 ** M_ref['logMs_prog_deconv_gsmf'],
-             color='k', ls=':', linewidth=4, zorder=2,
-             label=r'${\rm Accounting\ for\ random\ errors\ in\ the\ observed\ GSMF}$')
+    # Legend entries for the two line styles (proxy artists, nothing is drawn)
+    ref_handles = [Line2D([], [], color='k', ls='-', linewidth=4,
+                          label=r'${\rm Evolving\ halo\ cumulative\ number\ density}$'),
+                   Line2D([], [], color='k', ls=':', linewidth=4,
+                          label=r'${\rm Accounting\ for\ random\ errors\ in\ the\ observed\ GSMF}$')]
 
     ax1.set_ylabel(r'$n_{\rm vir} \; [\mathrm{Mpc}^{-3}]$', fontsize=35)
     ax1.set_xlabel(r'$1+z$', fontsize=35)
-    ax1.set_xscale("log")
     ax1.set_yscale("log")
-    ax1.legend(loc='upper left', fontsize=20, frameon=False)
-    ax1.axis([1, 11, 1E-5, 1])
-    
-    x_ticks = np.arange(1, 12)
-    ax1.set_xticks(x_ticks)
-    ax1.set_xticklabels([f'${int(x)}$' for x in x_ticks], fontsize=35)
+    ax1.legend(handles=ref_handles, loc='upper left', fontsize=20, frameon=False)
+    ax1.set_ylim(1E-5, 1)
     
     # -------------------------------------------------------------------------
     # 7) Second plot: evolution of stellar mass (logMs) vs. (1 + z)
     # -------------------------------------------------------------------------
-    for key in keys:
-        res = results[key]
-        # Replace 'p' with '.' in the legend exponent
-        key_label = key.replace('p', '.')
-        ax2.plot(1. + res['z'], 10 ** res['logMs'], 
-                 color=key_color_map[key], ls='-', linewidth=4, zorder=2,
-                 label=rf'$M_{{\ast}} = 10^{{{key_label}}}\,\mathrm{{M}}_\odot$')
-        
-        ax2.plot(1. + data_dict[key]['z'], 10 ** data_dict[key]['logMs_prog_deconv_gsmf'],
-                 color=key_color_map[key], ls=':', linewidth=4, zorder=2)
+    model_segs = [_segment(*precomp[key][:2], max_points) for key in keys]
+    ref_segs = [_segment(*precomp[key][2:4], max_points) for key in keys]
+    ax2.add_collection(LineCollection(model_segs, colors=colors, linewidths=4,
+                                      linestyles='-', rasterized=True))
+    ax2.add_collection(LineCollection(ref_segs, colors=colors, linewidths=4,
+                                      linestyles=':', rasterized=True))
+    
+    # Proxy artists carry the per-key legend labels
+    handles = []
+    for _, color, _, key_label in info:
+        handles.append(Line2D([], [], color=color, ls='-', linewidth=4,
+                              label=rf'$M_{{\ast}} = 10^{{{key_label}}}\,\mathrm{{M}}_\odot$'))
     
     ax2.set_ylabel(r'$M_{\ast}(z) \; [\mathrm{M}_{\odot}]$', fontsize=35)
     ax2.set_xlabel(r'$1+z$', fontsize=35)
-    ax2.set_xscale("log")
     ax2.set_yscale("log")
-    ax2.legend(loc='lower left', fontsize=20, frameon=False)
-    ax2.axis([1, 11, 1E5, 8E11])
-    
-    ax2.set_xticks(x_ticks)
-    ax2.set_xticklabels([f'${int(x)}$' for x in x_ticks], fontsize=35)
+    ax2.legend(handles=handles, loc='lower left', fontsize=20, frameon=False)
+    ax2.set_ylim(1E5, 8E11)
     
     # -------------------------------------------------------------------------
-    # 8) Tight layout and show
+    # 8) Tight layout; rendering is left to the caller
     # -------------------------------------------------------------------------
     fig.tight_layout()
-    plt.show()
\ No newline at end of file
+    return fig, (ax1, ax2)
\ No newline at end of file
@@ -0,0 +1,20 @@
+# utils.py
+"""
+Shared helpers for the MatchA modules.
+
+numba is an optional dependency: if it is installed, `njit` is numba's JIT
+decorator; otherwise it is a no-op, so the decorated functions run as plain
+Python/NumPy code.
+"""
+
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        """
+        Fallback for numba.njit when numba is not available. Works both as
+        @njit and as @njit(...), returning the function unchanged.
+        """
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
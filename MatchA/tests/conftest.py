@@ -0,0 +1,10 @@
+# conftest.py
+"""
+Makes the MatchA sources importable as `src` when pytest is run from the
+repository root or from MatchA.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
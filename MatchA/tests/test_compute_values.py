@@ -0,0 +1,59 @@
+# test_compute_values.py
+"""
+End-to-end tests of MassFunctionCalculator.compute_values against the
+reference curves stored in sham_lognormal_distributions.dat.
+"""
+
+import os
+import warnings
+
+import numpy as np
+import pytest
+
+from src.calculations import MassFunctionCalculator, _mf_cached
+
+COSMOLOGY = {'h_0': 0.678, 'O_m0': 0.307115, 'O_b0': 0.048,
+             'n': 0.96, 'sigma_8': 0.823}
+KEYS = ['9', '9p5', '10', '10p5', '11', '11p5']
+LOGMS_0 = [9., 9.5, 10., 10.5, 11., 11.5]
+DATA_FILENAME = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             'sham_lognormal_distributions.dat')
+
+@pytest.fixture(scope='module')
+def reference():
+    with open(DATA_FILENAME) as f:
+        names = f.readline().lstrip('#').split()
+    data = np.loadtxt(DATA_FILENAME)
+    return {name: data[:, i] for i, name in enumerate(names)}
+
+@pytest.fixture(scope='module')
+def results():
+    return MassFunctionCalculator(COSMOLOGY).compute_values()
+
+def test_compute_values_emits_no_warnings():
+    # Start from an empty MassFunction cache, so that hmf's own
+    # computations run inside the test as well
+    _mf_cached.cache_clear()
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        MassFunctionCalculator(COSMOLOGY).compute_values(num_samples=20)
+
+def test_compute_values_matches_reference_at_z0(results, reference):
+    for key, logMs_0 in zip(KEYS, LOGMS_0):
+        rows = np.isclose(reference['logMs_0'], logMs_0) & (reference['z'] == 0)
+        assert rows.any()
+        # The z0 halo densities are the integrals of the GSMF the reference
+        # curves were matched to
+        np.testing.assert_allclose(results[key]['nvir'][0],
+                                   reference['ngal_obs'][rows], rtol=1e-4)
+        np.testing.assert_allclose(results[key]['logMs'][0], logMs_0, atol=1e-4)
+
+def test_compute_values_follows_reference_at_low_z(results, reference):
+    # The reference curves also include the scatter of the stellar-halo
+    # relation, which the median tracks here leave out; the two only agree
+    # closely near z0
+    for key, logMs_0 in zip(KEYS, LOGMS_0):
+        rows = np.isclose(reference['logMs_0'], logMs_0) & (reference['z'] <= 0.1)
+        logMs = np.interp(reference['z'][rows], results[key]['z'], results[key]['logMs'])
+        np.testing.assert_allclose(logMs, reference['logMs_prog_obs_gsmf'][rows],
+                                   rtol=0, atol=0.05)
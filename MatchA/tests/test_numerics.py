@@ -0,0 +1,119 @@
+# test_numerics.py
+"""
+Regression tests for the vectorized numerical kernels against the scalar
+reference computations they replaced (scipy quad, bisect and interp1d),
+on a small (logMs, z) grid.
+"""
+
+import numpy as np
+import pytest
+from scipy.integrate import quad
+from scipy.interpolate import interp1d
+from scipy.optimize import bisect
+
+from src import gsmf as smf
+from src import halo_assembly as hal
+from src.calculations import MassFunctionCalculator, _GSMF_MODE
+
+COSMOLOGY = {'h_0': 0.678, 'O_m0': 0.307115, 'O_b0': 0.048,
+             'n': 0.96, 'sigma_8': 0.823}
+Z_GRID = np.array([0., 0.5, 1., 2., 4., 7., 11.])
+LOGMS_GRID = np.array([8., 9., 10., 11., 11.5, 12.])
+
+def quad_integral(logM_i, z):
+    """Reference: GSMF integrated from logM_i to 13 with scipy quad."""
+    return quad(lambda logMs: smf.phi_GSMF(logMs, z, _GSMF_MODE), logM_i, 13,
+                epsabs=0, epsrel=1e-12, limit=200)[0]
+
+@pytest.fixture(scope='module')
+def reference_integrals():
+    return np.array([[quad_integral(logM_i, z) for z in Z_GRID]
+                     for logM_i in LOGMS_GRID])
+
+@pytest.fixture(scope='module')
+def calculator():
+    return MassFunctionCalculator(COSMOLOGY)
+
+def test_integrate_phi_GSMF_matches_quad(reference_integrals):
+    result = smf.integrate_phi_GSMF(LOGMS_GRID[:, None], Z_GRID[None, :], _GSMF_MODE)
+    np.testing.assert_allclose(result, reference_integrals, rtol=1e-8, atol=0)
+
+def test_integrate_phi_GSMF_scalar(reference_integrals):
+    result = smf.integrate_phi_GSMF(10., 1., _GSMF_MODE)
+    assert np.ndim(result) == 0
+    np.testing.assert_allclose(result, reference_integrals[2, 2], rtol=1e-8)
+
+def test_integrate_phi_GSMF_grid_matches_quad(reference_integrals):
+    logMs_grid = np.linspace(1., 13., 4096)
+    log_int = smf.integrate_phi_GSMF_grid(logMs_grid, Z_GRID, _GSMF_MODE)
+    assert log_int.shape == (logMs_grid.size, Z_GRID.size)
+    assert np.all(np.isneginf(log_int[-1]))
+
+    table = np.array([[np.interp(logM_i, logMs_grid, log_int[:, j])
+                       for j in range(Z_GRID.size)] for logM_i in LOGMS_GRID])
+    # The trapezoidal table is only expected to be accurate where the
+    # integral is physically relevant
+    relevant = reference_integrals > 1e-8
+    np.testing.assert_allclose(table[relevant],
+                               np.log10(reference_integrals[relevant]),
+                               rtol=0, atol=1e-3)
+
+def test_SHAM_ste_grid_matches_bisect(calculator):
+    n_vir = np.array([1e-2, 1e-3, 1e-3, 1e-4, 1e-4, 1e-5, 1e-6])
+    table = calculator._log_gsmf_table(Z_GRID)
+    result = calculator.SHAM_ste_grid(n_vir, table)
+
+    expected = np.array([
+        bisect(lambda logMs: np.log10(n) - np.log10(quad_integral(logMs, z)),
+               1, 12.5, xtol=1e-12)
+        for z, n in zip(Z_GRID, n_vir)
+    ])
+    np.testing.assert_allclose(result, expected, rtol=0, atol=1e-4)
+
+def test_SHAM_ste_wrappers_match_grid(calculator):
+    n_vir = np.array([1e-2, 1e-3, 1e-3, 1e-4, 1e-4, 1e-5, 1e-6])
+    expected = calculator.SHAM_ste_grid(n_vir, calculator._log_gsmf_table(Z_GRID))
+    np.testing.assert_allclose(calculator.SHAM_ste_vec(Z_GRID, n_vir), expected,
+                               rtol=0, atol=1e-12)
+    np.testing.assert_allclose(calculator.SHAM_ste(Z_GRID[2], n_vir[2]), expected[2],
+                               rtol=0, atol=1e-12)
+    assert abs(calculator.func_solve(expected[2], Z_GRID[2], n_vir[2])) < 1e-4
+
+def test_SHAM_ste_grid_invalid_n_vir(calculator):
+    n_vir = np.array([1e-2, np.nan, 0., -1e-3, 1e-4, 1e-5, 1e-6])
+    table = calculator._log_gsmf_table(Z_GRID)
+    result = calculator.SHAM_ste_grid(n_vir, table)
+    assert np.all(np.isnan(result[1:4]))
+    valid = [0, 4, 5, 6]
+    np.testing.assert_array_equal(
+        result[valid],
+        calculator.SHAM_ste_grid(n_vir[valid], (table[0], table[1][:, valid]))
+    )
+
+def test_SHAM_ste_grid_out_of_range(calculator):
+    table = calculator._log_gsmf_table(Z_GRID)
+    assert np.all(np.isfinite(table[1][0]))
+    with pytest.raises(ValueError):
+        calculator.SHAM_ste_grid(np.full(Z_GRID.size, 1e-40), table)
+    with pytest.raises(ValueError):
+        calculator.SHAM_ste_grid(np.full(Z_GRID.size, 1e5), table)
+
+def test_hmf_vec_matches_interp1d(calculator):
+    z = np.array([0., 1., 3.])
+    logMvir = np.array([10., 12., 13.5])
+    result = calculator.hmf_vec(z, logMvir)
+
+    expected = []
+    for z_i, logM_i in zip(z, logMvir):
+        mf = calculator._mass_function(z_i)
+        log_m = np.log10(mf.m)
+        nvir = hal.Total_cumulative_halo_function(log_m, mf.ngtm, z_i, calculator.h_0)
+        expected.append(10 ** interp1d(log_m, np.log10(nvir))(logM_i))
+    np.testing.assert_allclose(result, expected, rtol=1e-12)
+    np.testing.assert_allclose(result, [calculator.hmf(z_i, logM_i)
+                                        for z_i, logM_i in zip(z, logMvir)],
+                               rtol=1e-12)
+
+def test_hmf_vec_out_of_range(calculator):
+    with pytest.raises(ValueError):
+        calculator.hmf_vec(np.array([0.]), np.array([6.]))